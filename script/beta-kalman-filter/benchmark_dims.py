@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+
+from stock_model.beta import design
+from stock_model.kalman_filter import (
+    reverse_loglik, reverse_loglik_and_grad, run_filtering, run_smoothing
+)
+
+
+# 状態の次元（ファクター数+1）ごとに1時点あたりの計算時間を比べる
+#   filter+smooth: run_filtering + run_smoothing（cov="packed"）
+#   loglik: 目的関数1回
+#   value+grad: 目的関数と前進差分の勾配（dims+2点）をloglik_batchで一度に評価
+#   value+grad (serial): 同じ点をreverse_loglikで一つずつ評価した場合
+rng = np.random.default_rng(1234)
+T = 2000
+n_repeat = 3
+
+
+def per_step(f):
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        f()
+    return (time.perf_counter() - start) / n_repeat / T * 1e6
+
+
+print(f"T={T}, us/step")
+print(f"{'dims':>4} {'filter+smooth':>14} {'loglik':>8} {'value+grad':>11} {'(serial)':>9} {'speedup':>8}")
+for dims in [2, 3, 5, 8, 10]:
+    x = rng.normal(size=(T, dims - 1))
+    y = x.sum(axis=1) + rng.normal(size=T)
+    G, F, m0, C0 = design(x)
+    w_v = np.full(dims + 1, -3.0)
+    W, V = np.eye(dims) * 0.05, np.eye(1)
+
+    def filter_smooth():
+        res = run_filtering(y, G, F, W, V, m0, C0, cov="packed")
+        run_smoothing(res, G)
+
+    t_filter = per_step(filter_smooth)
+    t_loglik = per_step(lambda: reverse_loglik(w_v, dims, y, G, F, m0, C0))
+    t_grad = per_step(lambda: reverse_loglik_and_grad(w_v, dims, y, G, F, m0, C0))
+    t_serial = t_loglik * (len(w_v) + 1)
+    print(f"{dims:>4} {t_filter:>14.1f} {t_loglik:>8.1f} {t_grad:>11.1f} {t_serial:>9.1f} {t_serial / t_grad:>7.1f}x")
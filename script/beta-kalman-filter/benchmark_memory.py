@@ -0,0 +1,57 @@
+import tracemalloc
+
+import numpy as np
+
+from stock_model.beta import design
+from stock_model.kalman_filter import loglik, run_filtering, run_smoothing
+
+
+# フィルタリング・平滑化の履歴（m, C, a, R, f, Q, s, S）のメモリ使用量を保存形式ごとに比べる
+modes = [
+    ("full", "full", np.float64),
+    ("packed", "packed", np.float64),
+    ("packed float32", "packed", np.float32),
+    ("diag (filter only)", "diag", np.float64),
+]
+
+
+def history_nbytes(T, dims, cov, dtype):
+    cov_size = {"full": dims * dims, "packed": dims * (dims + 1) // 2, "diag": dims}[cov]
+    # m, a, s: (T, dims) / C, R, S: (T, cov_size) / f, Q: (T,)
+    n_mean = 2 if cov == "diag" else 3
+    n_cov = 2 if cov == "diag" else 3
+    return T * (n_mean * dims + n_cov * cov_size + 2) * np.dtype(dtype).itemsize
+
+
+# 日次で約22年（T=5,500）, 5分足で1年（288本×250日）と10年
+for dims in [2, 10]:
+    print(f"dims={dims}")
+    for T in [5500, 72000, 720000]:
+        full = history_nbytes(T, dims, "full", np.float64)
+        row = ", ".join(
+            f"{name} {history_nbytes(T, dims, cov, dtype) / 1e6:8.2f}MB ({history_nbytes(T, dims, cov, dtype) / full:4.0%})"
+            for name, cov, dtype in modes
+        )
+        print(f"  T={T:>7}: {row}, loglik only 0MB")
+
+# T=5,500, dims=2で実際に計測したピークメモリ
+rng = np.random.default_rng(1234)
+T = 5500
+x = rng.normal(size=T)
+y = 0.5 + 1.2 * x + rng.normal(size=T)
+G, F, m0, C0 = design(x)
+W, V = np.eye(2) * 0.01, np.eye(1)
+print(f"measured peak (T={T}, dims=2)")
+for name, cov, dtype in modes:
+    tracemalloc.start()
+    res = run_filtering(y, G, F, W, V, m0, C0, cov=cov, dtype=dtype)
+    if cov != "diag":
+        res.update(run_smoothing(res, G, dtype=dtype))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del res
+    print(f"  {name:>20}: {peak / 1e3:8.1f}kB")
+tracemalloc.start()
+loglik(y, G, F, W, V, m0, C0)
+print(f"  {'loglik only':>20}: {tracemalloc.get_traced_memory()[1] / 1e3:8.1f}kB")
+tracemalloc.stop()
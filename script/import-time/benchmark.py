@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import time
+
+
+# stock_modelのimport時間と、各スクリプトが先頭でimportしていた重いライブラリのimport時間を比べる
+# 1回ごとに新しいプロセスを立ち上げて計測する（リポジトリのルートで実行する）
+targets = [
+    "stock_model.cli",
+    "stock_model.beta",
+    "stock_model.realized_volatility",
+    "stock_model.msv",
+    "stock_model.leverage",
+    "stock_model.dcc",
+    "scipy.optimize",
+    "plotnine",
+    "patchworklib",
+    "arviz",
+    "cmdstanpy",
+    "pandas_datareader.data",
+]
+n_repeat = 5
+
+
+def measure(module):
+    elapsed = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", f"import {module}"], capture_output=True)
+        elapsed.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return None
+    return min(elapsed)
+
+
+baseline = measure("sys")
+for module in targets:
+    elapsed = measure(module)
+    if elapsed is None:
+        print(f"{module:>32}: not installed")
+    else:
+        print(f"{module:>32}: {(elapsed - baseline) * 1000:7.1f} ms")
@@ -0,0 +1,28 @@
+import time
+
+import numpy as np
+
+from stock_model.leverage import DAYS, MULTIPLES, load_topix_csv, resample_index, simulate_chunk
+
+
+# iidとブロック・ブートストラップでスループットが同程度であることを確認する
+ret = load_topix_csv("../../data/topix.csv")
+n_paths = 10000
+n_repeat = 5
+
+for method in ["iid", "moving_block", "stationary"]:
+    rng = np.random.default_rng(1234)
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        resample_index(rng, len(ret), n_paths, max(DAYS), method, block_length=20)
+    elapsed_index = (time.perf_counter() - start) / n_repeat
+
+    start = time.perf_counter()
+    for i in range(n_repeat):
+        simulate_chunk(ret, DAYS, MULTIPLES, n_paths, i, method, block_length=20)
+    elapsed_chunk = (time.perf_counter() - start) / n_repeat
+
+    print(
+        f"{method:>12}: index {n_paths / elapsed_index / 1e6:6.2f}M paths/s, "
+        f"chunk {n_paths / elapsed_chunk / 1e3:6.1f}k paths/s"
+    )
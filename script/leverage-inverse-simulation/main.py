@@ -0,0 +1,28 @@
+from stock_model import instrument
+from stock_model.leverage import DAYS, MULTIPLES, load_topix_csv, simulate_sketch, summarize
+
+
+if __name__ == "__main__":
+    # J-QuantsのTOPIXを使う場合はload_topix_jquants(jquantsapi.Client(...))
+    with instrument.span("load"):
+        ret = load_topix_csv("../../data/topix.csv")
+
+    n_replication = 1000000
+    # 全試行を保持せず、チャンクごとのスケッチをマージして分位点を求める
+    with instrument.span("simulate", method="iid", n_replication=n_replication):
+        sketch = simulate_sketch(ret, DAYS, MULTIPLES, n_replication=n_replication, chunk_size=10000, seed=1234)
+    res = summarize(sketch, DAYS, MULTIPLES)
+    print(res)
+    # ボラティリティ・クラスタリングを残すため、平均20営業日のブロックで復元抽出する
+    with instrument.span("simulate", method="stationary", n_replication=n_replication):
+        sketch_block = simulate_sketch(
+            ret, DAYS, MULTIPLES, n_replication=n_replication, chunk_size=10000, seed=1234,
+            method="stationary", block_length=20
+        )
+    res_block = summarize(sketch_block, DAYS, MULTIPLES)
+    print(res_block)
+    print(
+        res
+        .select("multiple", "day", "median")
+        .pivot(on="day", index="multiple", values="median")
+    )
@@ -6,6 +6,8 @@ import polars as pl
 import requests
 from tqdm import tqdm
 
+from stock_model import instrument
+
 
 endpoint = "https://forex-api.coin.z.com/public/v1/klines"
 dates = [i.strftime("%Y%m%d") for i in pl.date_range(
@@ -17,17 +19,19 @@ dates = [i.strftime("%Y%m%d") for i in pl.date_range(
 dates
 
 res = []
-for date in tqdm(dates):
-    params = {
-        "symbol": "USD_JPY",
-        "priceType": "ASK",
-        "interval": "5min",
-        "date": date,
-    }
-    resp = requests.get(endpoint, params=params)
-    # データが存在しない日（市場が開いていない日）は空のリスト("[]")のままappendする
-    res.append(pl.DataFrame(json.loads(resp.text)["data"]))
-    # time.sleep(1)
+with instrument.span("fetch", source="gmo", n_dates=len(dates)):
+    for date in tqdm(dates):
+        params = {
+            "symbol": "USD_JPY",
+            "priceType": "ASK",
+            "interval": "5min",
+            "date": date,
+        }
+        resp = requests.get(endpoint, params=params)
+        instrument.count("http_request")
+        # データが存在しない日（市場が開いていない日）は空のリスト("[]")のままappendする
+        res.append(pl.DataFrame(json.loads(resp.text)["data"]))
+        # time.sleep(1)
 df = pl.concat([i for i in res if not i.is_empty()])
 df
 
@@ -1,55 +1,21 @@
 import datetime
-import math
 
 import patchworklib as pw
 import plotnine as pn
 import polars as pl
-import scipy as sp
 
+from stock_model import instrument
+from stock_model.realized_volatility import read_klines, realized_measures
 
-df = pl.read_csv("../../data/usdjpy_5min_20231029_20241204.csv")
 
-# 元のtimestamp列はUTCっぽい
-# JSTの6:00がその日の始まり（月曜日は7:00）
-df = (
-    df
-    .rename({"openTime": "openTimeUtc"})
-    .with_columns(
-        timestamp_utc=pl.from_epoch(pl.col("openTimeUtc").cast(int), time_unit="ms")
-    )
-    .with_columns(
-        timestamp_jst=pl.col("timestamp_utc")+datetime.timedelta(hours=9),
-        timestamp=pl.col("timestamp_utc")+datetime.timedelta(hours=9)-datetime.timedelta(hours=6)
-    )
-    .with_columns(date=pl.col("timestamp").dt.date())
-)
+with instrument.span("load"):
+    df = read_klines("../../data/usdjpy_5min_20231029_20241204.csv")
 df
 
-mu_1 = 2**(1/2) * math.gamma(1) * math.gamma(1/2)**(-1)
-mu_4over3 = 2**(2/3) * math.gamma(7/6) * math.gamma(1/2)**(-1)
 alpha = 0.95
 
-df_volatility = (
-    df
-    .with_columns(ret=(pl.col("close").log() - pl.col("close").shift(1).log()) * 100)
-    .group_by("date")
-    .agg(
-        n=pl.len(),
-        rv=(pl.col("ret")**2).sum(),
-        bv=mu_1**(-2) * (pl.col("ret").abs() * pl.col("ret").shift(1).abs()).sum(),
-        tq=pl.len() * mu_4over3**(-3) * (pl.col("ret").abs()**(4/3) * pl.col("ret").shift(1).abs()**(4/3) * pl.col("ret").shift(2).abs()**(4/3)).sum(),
-    )
-    .sort("date")
-    .with_columns(
-        z=(pl.col("rv").log() - pl.col("bv").log()) / ((mu_1**(-4) + 2 * mu_1**(-2) - 5) * pl.col("tq") * pl.col("bv")**(-2) / pl.col("n"))**(1/2)
-    )
-    .with_columns(
-        j=pl.when(pl.col("z") > sp.stats.norm.ppf(alpha)).then(pl.col("rv") - pl.col("bv")).otherwise(pl.lit(0))
-    )
-    .with_columns(
-        c=pl.col("rv") - pl.col("j")
-    )
-)
+with instrument.span("realized_measures"):
+    df_volatility = realized_measures(df, alpha=alpha)
 
 p1 = (
     pn.ggplot(
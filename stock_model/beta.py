@@ -0,0 +1,166 @@
+import numpy as np
+import polars as pl
+
+from . import instrument, kalman_filter, panel
+from .cache import source_of
+from .kalman_filter import cov_diag, reverse_loglik_and_grad, run_filtering, run_smoothing
+
+
+def prepare(stock, market, how="inner", start=None, end=None):
+    """
+    個別株と市場の終値から、日付を揃えた収益率のDataFrameを作る
+
+    Params:
+        stock, market: "ソース:識別子", またはDate, Close列のDataFrame（panel.scanを参照）
+        how, start, end: panel.scanを参照。フィルタは欠測を扱えるので"outer"でもよい
+    Returns:
+        polars.DataFrame: date, close_stock, ret_stock, close_market, ret_market
+    """
+    df = panel.build({"Stock": stock, "Market": market}, how=how, start=start, end=end)
+    return df.rename({
+        "Date": "date",
+        "CloseStock": "close_stock", "RetStock": "ret_stock",
+        "CloseMarket": "close_market", "RetMarket": "ret_market",
+    })
+
+
+def design(x):
+    """
+    y_t = alpha_t + beta_1,t * x_1,t + ... + beta_k,t * x_k,t の観測行列と状態の初期分布
+
+    Params:
+        x: ファクターの収益率 (T,) または (T, k)
+    """
+    x = np.asarray(x, dtype=float).reshape(len(x), -1)
+    T, k = x.shape
+    dims = k + 1
+    G = np.eye(dims)
+    F = np.empty((T, dims))
+    F[:, 0] = 1
+    F[:, 1:] = x
+    m0 = np.zeros(dims)
+    C0 = np.eye(dims)*10000000
+    return G, F, m0, C0
+
+
+def _cache_key(cache, kind, *parts):
+    # フィルタの実装が変わったら別のキーになるよう、ソースコードもキーに含める
+    return cache.key(kind, source_of(kalman_filter), source_of(__file__), *parts)
+
+
+def fit_mle(y, G, F, m0, C0, per_state=False, cache=None):
+    """
+    対数尤度を最大化する状態誤差と観測誤差の分散を求める
+
+    Params:
+        per_state: Trueなら状態ごとに別の分散を持つ対角のW、FalseならW = eye * exp(w)
+        cache: stock_model.cache.Cache。同じデータ・設定での結果があれば最適化を省略する
+    Returns:
+        tuple: W, V
+    """
+    import scipy
+    import scipy.optimize
+
+    dims = len(m0)
+    init = [0.0] * (dims + 1 if per_state else 2)
+    if cache is not None:
+        key = _cache_key(cache, "fit_mle", y, G, F, m0, C0, "BFGS", init, scipy.__version__)
+        res = cache.load_arrays(key)
+        if res is not None:
+            instrument.count("cache_hit")
+            return res["W"], res["V"]
+        instrument.count("cache_miss")
+
+    with instrument.span("optimize", method="BFGS", T=len(y), dims=dims, n_params=len(init)):
+        # 値と数値微分の勾配を一回のフィルタリングでまとめて求める
+        best_par = scipy.optimize.minimize(
+            reverse_loglik_and_grad,
+            init,
+            args=(dims, y, G, F, m0, C0),
+            method="BFGS",
+            jac=True
+        )
+    W = np.diag(np.broadcast_to(np.exp(best_par.x[:-1]), (dims,)))
+    V = np.array([1]).reshape((1, 1)) * np.exp(best_par.x[-1])
+    if cache is not None:
+        cache.store_arrays(key, {"W": W, "V": V})
+    return W, V
+
+
+def filter_smooth(y, G, F, W, V, m0, C0, cov="full", dtype=np.float64, directory=None, cache=None):
+    """
+    フィルタリングと平滑化を行う
+
+    Params:
+        cov, dtype, directory: 履歴の保存形式（kalman_filter.run_filteringを参照）
+            標準誤差しか使わないならcov="packed"で十分
+        cache: stock_model.cache.Cache（directoryを指定したときは使わない）
+    Returns:
+        dict: m, C, a, R, f, Q, loglik（フィルタリング）, s, S（平滑化）, cov
+    """
+    if directory is not None:
+        cache = None
+    if cache is not None:
+        key = _cache_key(cache, "filter_smooth", y, G, F, W, V, m0, C0, cov, np.dtype(dtype).str)
+        res = cache.load_arrays(key)
+        if res is not None:
+            instrument.count("cache_hit")
+            res["loglik"], res["cov"] = res["loglik"].item(), res["cov"].item()
+            return res
+        instrument.count("cache_miss")
+
+    with instrument.span("filter", T=len(y), cov=cov):
+        res = run_filtering(y, G, F, W, V, m0, C0, cov=cov, dtype=dtype, directory=directory)
+    with instrument.span("smooth", T=len(y), cov=cov):
+        res.update(run_smoothing(res, G, dtype=dtype, directory=directory))
+    if cache is not None:
+        cache.store_arrays(key, res)
+    return res
+
+
+def estimate(df, cache=None):
+    """
+    prepareの結果から時変のalpha, betaを推定する
+
+    Params:
+        cache: stock_model.cache.Cache
+    Returns:
+        polars.DataFrame: date と、alpha, betaそれぞれのフィルタリング・平滑化の推定値と標準誤差
+    """
+    y = df.get_column("ret_stock").to_numpy()
+    x = df.get_column("ret_market").to_numpy()
+    return _estimate(df.get_column("date"), y, x, ["beta"], per_state=False, cache=cache)
+
+
+def estimate_factors(df, target, factors, per_state=True, cache=None):
+    """
+    panel.buildの結果から、targetの収益率を複数のファクターに回帰した時変のalpha, betaを推定する
+
+    Params:
+        target: 被説明変数の系列の名前（Ret{名前}の{名前}）
+        factors: ファクターの系列の名前のリスト（例: ["Topix", "USDJPY", "Reit"]）
+        per_state: 状態ごとに別の状態誤差の分散を推定するか（fit_mleを参照）
+        cache: stock_model.cache.Cache
+    Returns:
+        polars.DataFrame: date と、alpha, beta_{ファクター名}それぞれのフィルタリング・平滑化の推定値と標準誤差
+    """
+    y = df.get_column(f"Ret{target}").to_numpy()
+    x = panel.returns_matrix(df, factors).T
+    return _estimate(df.get_column("Date"), y, x, [f"beta_{name}" for name in factors], per_state, cache)
+
+
+def _estimate(date, y, x, names, per_state, cache):
+    G, F, m0, C0 = design(x)
+    W, V = fit_mle(y, G, F, m0, C0, per_state=per_state, cache=cache)
+    # 標準誤差しか使わないので、共分散行列は上三角部分だけ保存する
+    res = filter_smooth(y, G, F, W, V, m0, C0, cov="packed", cache=cache)
+    se_filtered = np.sqrt(cov_diag(res["C"], "packed"))
+    se_smoothed = np.sqrt(cov_diag(res["S"], "packed"))
+    columns = {"date": date}
+    for i, name in enumerate(["alpha"] + names):
+        columns[f"{name}_filtered"] = res["m"][:, i]
+        columns[f"{name}_filtered_se"] = se_filtered[:, i]
+    for i, name in enumerate(["alpha"] + names):
+        columns[f"{name}_smoothed"] = res["s"][:, i]
+        columns[f"{name}_smoothed_se"] = se_smoothed[:, i]
+    return pl.DataFrame(columns)
@@ -0,0 +1,159 @@
+"""
+推定結果（カルマンフィルタの最尤推定, Stanの事後分布）のキャッシュ
+
+キーは入力データの配列, モデルのソースコード, 最適化・サンプリングの設定のハッシュなので、
+データやモデルが変わると必ず別のキーになり、古い結果が返ることはない
+
+容量がmax_bytesを超えたら、最後に使われた時刻（mtime）が古いものから削除する
+書き込みは一時ファイルからos.replaceで置き換え、置き換えと削除は排他ロック、
+読み込みは共有ロックの中で行うので、並列に動くジョブから同じディレクトリを使ってよい
+"""
+import contextlib
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# 保存形式を変えたらこの値を変えて、以前のエントリに当たらないようにする
+VERSION = 1
+_LOCK_NAME = ".lock"
+_TMP_PREFIX = "tmp-"
+
+
+def _update(h, part):
+    """
+    partを型ごとに曖昧さのないバイト列にしてハッシュに加える
+    """
+    if isinstance(part, np.ndarray):
+        arr = np.ascontiguousarray(part)
+        header = json.dumps(["ndarray", arr.dtype.str, arr.shape]).encode()
+        h.update(len(header).to_bytes(8, "little") + header)
+        h.update(arr.nbytes.to_bytes(8, "little"))
+        h.update(arr.tobytes())
+    elif isinstance(part, (bytes, bytearray)):
+        h.update(b"bytes" + len(part).to_bytes(8, "little"))
+        h.update(part)
+    elif isinstance(part, str):
+        _update(h, part.encode())
+        h.update(b"str")
+    elif isinstance(part, dict):
+        h.update(b"dict" + len(part).to_bytes(8, "little"))
+        for k in sorted(part):
+            _update(h, str(k))
+            _update(h, part[k])
+    elif isinstance(part, (list, tuple)):
+        h.update(b"list" + len(part).to_bytes(8, "little"))
+        for p in part:
+            _update(h, p)
+    elif part is None or isinstance(part, (bool, int, float, np.integer, np.floating)):
+        _update(h, repr(part).encode())
+        h.update(b"scalar")
+    else:
+        raise TypeError(f"cannot hash {type(part).__name__} for a cache key")
+
+
+def source_of(module_or_path):
+    """
+    モジュールまたはファイル（Stanファイルなど）のソースのバイト列
+    """
+    path = getattr(module_or_path, "__file__", module_or_path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class Cache:
+    """
+    Params:
+        directory: 保存先。Noneなら環境変数STOCK_MODEL_CACHE、なければ~/.cache/stock_model
+        max_bytes: 保存する合計サイズの上限
+    """
+
+    def __init__(self, directory=None, max_bytes=2 * 1024**3):
+        if directory is None:
+            directory = os.environ.get("STOCK_MODEL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "stock_model"))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, *parts):
+        h = hashlib.sha256()
+        _update(h, [VERSION, list(parts)])
+        return h.hexdigest()
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    @contextlib.contextmanager
+    def _lock(self, exclusive):
+        # fcntlがない環境（Windows）ではロックしない
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, _LOCK_NAME), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self, key, suffix, reader):
+        """
+        エントリがあればreader(path)の結果を返し、なければNoneを返す
+        readerはファイルの中身をすべてメモリに読み込むこと（ロックを外したあとに削除されうるため）
+        """
+        path = self.path(key, suffix)
+        with self._lock(exclusive=False):
+            if not os.path.exists(path):
+                return None
+            os.utime(path)
+            return reader(path)
+
+    def store(self, key, suffix, writer):
+        """
+        writer(path)で一時ファイルに書き込んでから置き換え、容量を超えていれば古いものから削除する
+        """
+        tmp = os.path.join(self.directory, f"{_TMP_PREFIX}{uuid.uuid4().hex}-{key}{suffix}")
+        try:
+            writer(tmp)
+            with self._lock(exclusive=True):
+                os.replace(tmp, self.path(key, suffix))
+                self._evict(keep=key + suffix)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _evict(self, keep):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name == _LOCK_NAME or entry.name.startswith(_TMP_PREFIX) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, path, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            os.remove(path)
+            total -= size
+
+    def load_arrays(self, key):
+        """
+        store_arraysで保存した配列の辞書を読み込む
+        """
+        def reader(path):
+            with np.load(path) as npz:
+                return {k: npz[k] for k in npz.files}
+        return self.load(key, ".npz", reader)
+
+    def store_arrays(self, key, arrays):
+        self.store(key, ".npz", lambda path: np.savez(path, **arrays))
@@ -0,0 +1,187 @@
+"""
+バッチ実行用のCLI（プロットは作らず、結果をParquetに書き出す）
+
+    python -m stock_model beta --stock stooq:9501.JP --market stooq:^NKX --start 2001-01-01 --out beta.parquet
+    python -m stock_model beta --stock csv:data/9501_tepcoHD.csv --market csv:data/topix.csv \\
+        --factor Gas=csv:data/9531_tokyogas.csv --factor ANA=csv:data/9202_ANAHD.csv --out beta_factors.parquet
+    python -m stock_model realized-vol --input data/usdjpy_5min.csv --out rv.parquet
+    python -m stock_model msv-fit --series Topix=jquants:0000 Reit=jquants:0075 \\
+        --model script/msv-model/model_v4.stan --inits 0.1 --returns-out returns.parquet --out fit.nc
+    python -m stock_model msv-summarize --returns returns.parquet --idata fit.nc --out summary.parquet
+    python -m stock_model dcc --series Topix=csv:data/topix.csv Tepco=csv:data/9501_tepcoHD.csv Gas=csv:data/9531_tokyogas.csv \\
+        --out pairs.parquet --pair Topix Gas --pair-out dcc.parquet
+
+重いライブラリ（scipy.optimize, cmdstanpy, arviz, pandas_datareader, jquantsapi）は
+サブコマンドの実行時に初めてimportする
+
+リポジトリのルートで pip install -e ".[all]" とすれば、どのディレクトリからでも
+python -m stock_model（またはstock-model）として実行でき、script/*もstock_modelをimportできる
+"""
+import argparse
+import datetime
+
+from . import instrument
+
+
+def _beta(args):
+    from . import beta, panel, sources
+
+    if args.factor:
+        # 市場とファクターの多変量回帰（状態ごとに別の分散）
+        series = {"Stock": args.stock, "Market": args.market, **_series(args.factor)}
+        df = panel.build(series, how=args.how, start=args.start, end=args.end)
+        res = beta.estimate_factors(df, "Stock", list(series)[1:], cache=_cache(args))
+        res.write_parquet(args.out)
+        return
+
+    with instrument.span("fetch", spec=args.stock):
+        df_stock = sources.load(args.stock, args.start, args.end)
+    with instrument.span("fetch", spec=args.market):
+        df_market = sources.load(args.market, args.start, args.end)
+    df = beta.prepare(df_stock, df_market, how=args.how)
+    beta.estimate(df, cache=_cache(args)).write_parquet(args.out)
+
+
+def _realized_vol(args):
+    from . import realized_volatility
+
+    with instrument.span("load"):
+        df = realized_volatility.read_klines(args.input)
+    with instrument.span("realized_measures"):
+        res = realized_volatility.realized_measures(df, alpha=args.alpha)
+    res.write_parquet(args.out)
+
+
+def _msv_fit(args):
+    from . import msv
+
+    # 読み込みから結合までpanelで一つのクエリにする
+    df = msv.prepare_returns(_series(args.series), args.start, args.end, how=args.how)
+    df.write_parquet(args.returns_out)
+    idata = msv.fit(
+        args.model, msv.stan_data(df),
+        chains=args.chains, iter_warmup=args.warmup, iter_sampling=args.samples,
+        seed=args.seed, inits=args.inits, show_progress=False, cache=_cache(args),
+    )
+    idata.to_netcdf(args.out)
+
+
+def _msv_summarize(args):
+    import arviz as az
+    import polars as pl
+
+    from . import msv
+
+    df = pl.read_parquet(args.returns)
+    idata = az.from_netcdf(args.idata)
+    msv.summarize(idata, df).write_parquet(args.out)
+
+
+def _dcc(args):
+    from . import dcc, panel
+
+    if args.pair and not args.pair_out:
+        raise SystemExit("dcc: --pair requires --pair-out")
+    df = panel.build(_series(args.series), how=args.how, start=args.start, end=args.end)
+    fitted = dcc.fit(df)
+    dcc.screen(fitted).write_parquet(args.out)
+    if args.pair:
+        dcc.summarize(fitted, args.pair, n_draws=args.draws).write_parquet(args.pair_out)
+
+
+def _series(items):
+    """
+    NAME=SPECの並びを{名前: 系列}にする
+    """
+    series = {}
+    for item in items:
+        name, sep, spec = item.partition("=")
+        if not sep or not name or not spec:
+            raise SystemExit(f"expected NAME=SPEC (e.g. Topix=jquants:0000): {item}")
+        if name in series:
+            raise SystemExit(f"duplicate series name: {name}")
+        series[name] = spec
+    return series
+
+
+def _cache(args):
+    if args.cache is None:
+        return None
+    from .cache import Cache
+
+    return Cache(args.cache, max_bytes=int(args.cache_size * 1024**3))
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="stock_model")
+    parser.add_argument("--trace", help="計測結果(JSON Lines)の出力先")
+    parser.add_argument("--profile", help="cProfileの結果の出力先（--traceが必要）")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemallocでspanごとのピークメモリも測る（--traceが必要。計測対象は遅くなる）")
+    parser.add_argument("--cache", help="推定結果のキャッシュの保存先（beta, msv-fit）")
+    parser.add_argument("--cache-size", type=float, default=2.0, help="キャッシュの上限（GB）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("beta", help="カルマンフィルタで時変ベータを推定する")
+    p.add_argument("--stock", required=True, help="個別株の系列（例: stooq:9501.JP, csv:data/9501_tepcoHD.csv。stooqは--startが必須）")
+    p.add_argument("--market", required=True, help="市場の系列（例: stooq:^NKX, csv:data/topix.csv）")
+    p.add_argument("--start", type=_date)
+    p.add_argument("--end", type=_date)
+    p.add_argument("--factor", action="append", metavar="NAME=SPEC", help="市場以外のファクター（複数指定可。例: USDJPY=boj:usdjpy_boj_17.csv）")
+    p.add_argument("--how", choices=["inner", "outer", "asof"], default="inner", help="日付の揃え方。outerなら片方しか取引のない日は欠測として扱う")
+    p.add_argument("--out", required=True)
+    p.set_defaults(func=_beta)
+
+    p = subparsers.add_parser("realized-vol", help="5分足から日次の実現ボラティリティとジャンプを求める")
+    p.add_argument("--input", required=True, help="01_fetch.pyで保存したCSV")
+    p.add_argument("--alpha", type=float, default=0.95)
+    p.add_argument("--out", required=True)
+    p.set_defaults(func=_realized_vol)
+
+    p = subparsers.add_parser("msv-fit", help="多変量SVモデルをサンプリングする")
+    p.add_argument("--series", nargs=2, required=True, metavar="NAME=SPEC", help="例: Topix=jquants:0000 USDJPY=boj:usdjpy_boj_17.csv")
+    p.add_argument("--start", type=_date)
+    p.add_argument("--end", type=_date)
+    p.add_argument("--how", choices=["inner", "asof"], default="inner", help="日付の揃え方（panel.scanを参照）")
+    p.add_argument("--model", required=True, help="Stanファイル")
+    p.add_argument("--chains", type=int, default=4)
+    p.add_argument("--warmup", type=int, default=1000)
+    p.add_argument("--samples", type=int, default=1000)
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--inits", type=float)
+    p.add_argument("--returns-out", required=True, help="推定に使った収益率の出力先（Parquet）")
+    p.add_argument("--out", required=True, help="InferenceDataの出力先（NetCDF）")
+    p.set_defaults(func=_msv_fit)
+
+    p = subparsers.add_parser("msv-summarize", help="MSVモデルの事後分布を時点ごとに要約する")
+    p.add_argument("--returns", required=True, help="msv-fitの--returns-out")
+    p.add_argument("--idata", required=True, help="msv-fitの--out")
+    p.add_argument("--out", required=True)
+    p.set_defaults(func=_msv_summarize)
+
+    p = subparsers.add_parser("dcc", help="DCC-GARCH(1,1)で全ペアのボラティリティと相関係数を推定する")
+    p.add_argument("--series", nargs="+", required=True, metavar="NAME=SPEC", help="2系列以上（例: Topix=jquants:0000 Reit=jquants:0075 USDJPY=boj:usdjpy_boj_17.csv）")
+    p.add_argument("--start", type=_date)
+    p.add_argument("--end", type=_date)
+    p.add_argument("--how", choices=["inner", "asof"], default="inner", help="日付の揃え方（panel.scanを参照）")
+    p.add_argument("--out", required=True, help="全ペアの一覧（dcc.screen）の出力先")
+    p.add_argument("--pair", nargs=2, metavar="NAME", help="msv-summarizeと同じ形式で時点ごとの結果を出力するペア")
+    p.add_argument("--pair-out", help="--pairの出力先")
+    p.add_argument("--draws", type=int, default=200, help="区間を求めるパラメータのサンプル数")
+    p.set_defaults(func=_dcc)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.trace and (args.profile or args.trace_memory):
+        parser.error("--profile and --trace-memory require --trace")
+    if args.trace:
+        instrument.enable(args.trace, profile=args.profile, memory=args.trace_memory)
+    with instrument.span(args.command):
+        args.func(args)
+    instrument.disable()
@@ -0,0 +1,306 @@
+"""
+DCC-GARCH(1,1)の最尤推定（MSVモデルと比べるための手早い基準）
+
+2段階で推定する（Engle, 2002）
+    1. 系列ごとのGARCH(1,1): h_t = omega + alpha * y_(t-1)^2 + beta * h_(t-1)
+    2. 系列のペアごとのDCC(1,1): Q_t = (1 - a - b) * Qbar + a * z_(t-1) z_(t-1)' + b * Q_(t-1)
+       rho_t = q12_t / sqrt(q11_t * q22_t), z_t = y_t / sqrt(h_t)
+
+各段階の対数尤度は系列（ペア）ごとに独立なので、全系列（全ペア）をまとめてニュートン法で最適化する
+時点のループは一回で、各時点では全系列（全ペア）と差分の評価点をまとめて配列で計算する
+収益率の平均はMSVモデルと同じく0とする
+
+    fitted = dcc.fit(panel.build({"Topix": ..., "USDJPY": ..., "Reit": ...}))
+    dcc.screen(fitted)                      # 全ペアの一覧
+    dcc.summarize(fitted, ("Topix", "Reit"))  # msv.summarizeと同じ形式
+"""
+import itertools
+
+import numpy as np
+import polars as pl
+
+from . import instrument, panel
+
+# 最適化は制約のないパラメータで行う
+#   GARCH: [log omega, logit(alpha + beta), logit(alpha / (alpha + beta))]
+#   DCC: [logit(a + b), logit(a / (a + b))]
+
+# 差分の刻み幅
+_STEP = 1e-4
+# ニュートン法で試すステップ幅（ニュートン方向に対する倍率）と、1回のステップの大きさの上限
+_STEP_SIZES = np.array([1.0, 0.5, 0.25, 0.1, 0.03, 0.0])
+_MAX_STEP = 2.0
+_MIN_CURVATURE = 1e-3
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _logit(p):
+    return np.log(p / (1 - p))
+
+
+def _persistence(theta_p, theta_s):
+    p = _sigmoid(theta_p)
+    first = p * _sigmoid(theta_s)
+    return first, p - first
+
+
+def garch_params(theta):
+    """
+    制約のないパラメータ (..., 3) からomega, alpha, betaを求める
+    """
+    alpha, beta = _persistence(theta[..., 1], theta[..., 2])
+    return np.exp(theta[..., 0]), alpha, beta
+
+
+def dcc_params(theta):
+    """
+    制約のないパラメータ (..., 2) からa, bを求める
+    """
+    return _persistence(theta[..., 0], theta[..., 1])
+
+
+def garch_loglik(y2, theta, path=False):
+    """
+    GARCH(1,1)の対数尤度（定数項を除く）
+
+    Params:
+        y2: 収益率の2乗 (T, N)
+        theta: 制約のないパラメータ (..., N, 3)。先頭の次元は数値微分の評価点や事後分布の近似のサンプル
+        path: Trueなら条件付き分散の系列 (T, ..., N) も返す
+    Returns:
+        numpy.ndarray: (..., N)（pathがTrueならtuple）
+    """
+    omega, alpha, beta = garch_params(theta)
+    # 初期値は標本分散
+    h = np.broadcast_to(y2.mean(axis=0), omega.shape).copy()
+    ll = np.zeros(omega.shape)
+    hs = np.empty((len(y2),) + omega.shape) if path else None
+    for t in range(0, len(y2)):
+        if t > 0:
+            h = omega + alpha * y2[t-1] + beta * h
+        ll -= (np.log(h) + y2[t] / h) / 2
+        if path:
+            hs[t] = h
+    return (ll, hs) if path else ll
+
+
+def dcc_loglik(z, pairs, theta, path=False):
+    """
+    ペアごとのDCC(1,1)の対数尤度（相関の部分, 定数項を除く）
+
+    Params:
+        z: 標準化した収益率 (T, N)
+        pairs: ペアの添字 (P, 2)
+        theta: 制約のないパラメータ (..., P, 2)
+        path: Trueなら相関係数の系列 (T, ..., P) も返す
+    Returns:
+        numpy.ndarray: (..., P)（pathがTrueならtuple）
+    """
+    a, b = dcc_params(theta)
+    zi, zj = z[:, pairs[:, 0]], z[:, pairs[:, 1]]
+    # (3, T, 1, ..., P): thetaの先頭の次元に合わせて軸を足す
+    zz = np.stack([zi * zi, zj * zj, zi * zj])
+    zz = zz.reshape(zz.shape[:2] + (1,) * (a.ndim - 1) + zz.shape[2:])
+    qbar = zz.mean(axis=1)
+    intercept = (1 - a - b) * qbar  # (3, ..., P)
+    q = np.broadcast_to(qbar, intercept.shape).copy()
+    ll = np.zeros(a.shape)
+    rhos = np.empty((len(z),) + a.shape) if path else None
+    for t in range(0, len(z)):
+        if t > 0:
+            q = intercept + a * zz[:, t-1] + b * q
+        rho = q[2] / np.sqrt(q[0] * q[1])
+        one_minus = 1 - rho * rho
+        ll -= (np.log(one_minus) + (zz[0, t] + zz[1, t] - 2 * rho * zz[2, t]) / one_minus - zz[0, t] - zz[1, t]) / 2
+        if path:
+            rhos[t] = rho
+    return (ll, rhos) if path else ll
+
+
+def _derivatives(loglik, theta):
+    """
+    系列（ペア）ごとの対数尤度の値, 勾配 (units, k), ヘッセ行列 (units, k, k) を差分で求める
+    系列どうしは独立なので、k番目のパラメータを全系列で同時にずらした点をまとめて一度に評価する
+    """
+    n_params = theta.shape[1]
+    d = np.eye(n_params) * _STEP
+    ij = list(itertools.combinations_with_replacement(range(n_params), 2))
+    points = (
+        [theta]
+        + [theta + d[k] for k in range(n_params)]
+        + [theta - d[k] for k in range(n_params)]
+        + [theta + d[i] + d[j] for i, j in ij]
+    )
+    ll = loglik(np.stack(points))
+    plus, minus = ll[1:1 + n_params], ll[1 + n_params:1 + 2 * n_params]
+    grad = ((plus - minus) / (2 * _STEP)).T
+    hess = np.empty((theta.shape[0], n_params, n_params))
+    for n, (i, j) in enumerate(ij):
+        hess[:, i, j] = hess[:, j, i] = (ll[1 + 2 * n_params + n] - plus[i] - plus[j] + ll[0]) / _STEP**2
+    return ll[0], grad, hess
+
+
+def _newton(loglik, theta, name, tol=1e-4, maxiter=100):
+    """
+    系列（ペア）ごとに独立な対数尤度を、全系列まとめてニュートン法で最大化する
+
+    全パラメータを一つの最適化問題としてscipy.optimizeに渡すと、ステップ幅や収束判定が全系列で共通になり、
+    境界付近で平坦な系列に引きずられて収束が遅くなるので、系列ごとにステップ幅を選ぶ
+    ヘッセ行列が正定値でない方向は固有値の絶対値で割り、1回のステップの大きさは_MAX_STEPまでとする
+
+    Params:
+        tol: 全系列で1回の反復による対数尤度の増加がこれを下回ったら終了する
+    Returns:
+        tuple: 推定値 (units, k), 漸近共分散行列 (units, k, k)
+    """
+    units = np.arange(len(theta))
+    with instrument.span(name, units=len(theta)):
+        for _ in range(maxiter):
+            instrument.count("newton_iter")
+            ll, grad, hess = _derivatives(loglik, theta)
+            # -H = V diag(l) V' として、ステップは V diag(1/|l|) V' g
+            eigval, eigvec = np.linalg.eigh(-hess)
+            eigval = np.maximum(np.abs(eigval), _MIN_CURVATURE)
+            step = np.einsum("uij,uj->ui", eigvec, np.einsum("uji,uj->ui", eigvec, grad) / eigval)
+            norm = np.linalg.norm(step, axis=1, keepdims=True)
+            step *= np.minimum(1, _MAX_STEP / np.maximum(norm, _MIN_CURVATURE))
+            # 候補のステップ幅（最後は0 = 動かない）をまとめて評価し、系列ごとに最もよいものを選ぶ
+            candidates = theta + _STEP_SIZES[:, np.newaxis, np.newaxis] * step
+            ll_candidates = loglik(candidates)
+            best = np.argmax(ll_candidates, axis=0)
+            theta = candidates[best, units]
+            if (ll_candidates[best, units] - ll).max() < tol:
+                break
+        _, _, hess = _derivatives(loglik, theta)
+    return theta, _covariance(hess)
+
+
+def _covariance(hess):
+    """
+    ヘッセ行列からパラメータの漸近共分散行列を求める
+    境界に張り付いたパラメータの方向は対数尤度がほぼ平坦なので、分散は1までに抑える
+    """
+    eigval, eigvec = np.linalg.eigh(-hess)
+    eigval = np.maximum(eigval, 1.0)
+    return eigvec @ (eigvec.transpose(0, 2, 1) / eigval[..., np.newaxis])
+
+
+def fit(df, names=None):
+    """
+    全系列のGARCHと全ペアのDCCを推定する
+
+    Params:
+        df: panel.buildの結果（欠測のない"inner"か"asof"で揃えたもの）
+        names: 使う系列の名前（Noneならすべて）。2系列以上
+    Returns:
+        dict:
+            names, pairs (P, 2)
+            garch: omega, alpha, beta (N, 3), garch_theta, garch_cov: 制約のないパラメータとその共分散
+            dcc: a, b (P, 2), dcc_theta, dcc_cov
+            volatility: 条件付き標準偏差 (T, N), rho: 相関係数 (T, P)
+            loglik: ペアごとの対数尤度 (P,)（GARCHの2系列分と相関の部分の和）
+    """
+    if names is None:
+        names = panel.return_names(df)
+    if len(names) < 2:
+        raise ValueError(f"DCC needs 2 or more series (2系列以上): {list(names)}")
+    y = panel.returns_matrix(df, names).T
+    if np.isnan(y).any():
+        raise ValueError("returns must not contain missing values; build the panel with how='inner' or 'asof'")
+    pairs = np.array(list(itertools.combinations(range(len(names)), 2)))
+    y2 = y * y
+
+    var = y2.mean(axis=0)
+    theta0 = np.column_stack([np.log(var * 0.05), np.full(len(names), _logit(0.95)), np.full(len(names), _logit(0.05 / 0.95))])
+    garch_theta, garch_cov = _newton(lambda theta: garch_loglik(y2, theta), theta0, "garch")
+    garch_ll, h = garch_loglik(y2, garch_theta, path=True)
+
+    z = y / np.sqrt(h)
+    theta0 = np.column_stack([np.full(len(pairs), _logit(0.97)), np.full(len(pairs), _logit(0.03 / 0.97))])
+    dcc_theta, dcc_cov = _newton(lambda theta: dcc_loglik(z, pairs, theta), theta0, "dcc")
+    dcc_ll, rho = dcc_loglik(z, pairs, dcc_theta, path=True)
+
+    return {
+        "names": list(names),
+        "pairs": pairs,
+        "date": df.get_column("Date"),
+        "garch": np.column_stack(garch_params(garch_theta)),
+        "garch_theta": garch_theta,
+        "garch_cov": garch_cov,
+        "dcc": np.column_stack(dcc_params(dcc_theta)),
+        "dcc_theta": dcc_theta,
+        "dcc_cov": dcc_cov,
+        "y": y,
+        "volatility": np.sqrt(h),
+        "rho": rho,
+        "loglik": garch_ll[pairs[:, 0]] + garch_ll[pairs[:, 1]] + dcc_ll,
+    }
+
+
+def screen(fitted):
+    """
+    全ペアのDCCのパラメータと相関係数の要約
+
+    Returns:
+        polars.DataFrame: A, B, DccA, DccB（DCCのa, b）, RhoMean, RhoMin, RhoMax, RhoLast, LogLik
+    """
+    names, pairs, rho = fitted["names"], fitted["pairs"], fitted["rho"]
+    return pl.DataFrame({
+        "A": [names[i] for i in pairs[:, 0]],
+        "B": [names[j] for j in pairs[:, 1]],
+        "DccA": fitted["dcc"][:, 0],
+        "DccB": fitted["dcc"][:, 1],
+        "RhoMean": rho.mean(axis=0),
+        "RhoMin": rho.min(axis=0),
+        "RhoMax": rho.max(axis=0),
+        "RhoLast": rho[-1],
+        "LogLik": fitted["loglik"],
+    })
+
+
+def summarize(fitted, pair, n_draws=200, seed=1234):
+    """
+    ペアのボラティリティと相関係数の中央値と95%区間を時点ごとに求める（msv.summarizeと同じ形式）
+
+    区間はパラメータの推定誤差だけを反映する。最尤推定量の漸近正規分布からパラメータをn_draws個引き、
+    それぞれで条件付き分散と相関係数の系列を計算し直して分位点を取る
+    相関係数の区間ではGARCHのパラメータは推定値に固定する
+
+    Params:
+        fitted: fitの結果
+        pair: 系列の名前のペア (A, B)
+    Returns:
+        polars.DataFrame: Date, Volatility{A}Median/Lower/Upper, Volatility{B}Median/Lower/Upper, RhoMedian/Lower/Upper
+    """
+    names = fitted["names"]
+    i, j = names.index(pair[0]), names.index(pair[1])
+    k = next(k for k, (a, b) in enumerate(fitted["pairs"]) if {a, b} == {i, j})
+    rng = np.random.default_rng(seed)
+
+    def draws(theta, cov):
+        return rng.multivariate_normal(theta, cov, size=n_draws, method="eigh")
+
+    y = fitted["y"][:, [i, j]]
+    with instrument.span("summarize", n=len(y), draws=n_draws):
+        theta = np.stack([draws(fitted["garch_theta"][n], fitted["garch_cov"][n]) for n in (i, j)], axis=1)
+        _, h = garch_loglik(y * y, theta, path=True)  # (T, draws, 2)
+        vol = np.quantile(np.sqrt(h), [0.025, 0.5, 0.975], axis=1)  # (3, T, 2)
+        theta = draws(fitted["dcc_theta"][k], fitted["dcc_cov"][k])[:, np.newaxis, :]
+        z = fitted["y"] / fitted["volatility"]
+        _, rho = dcc_loglik(z, fitted["pairs"][[k]], theta, path=True)  # (T, draws, 1)
+        rho = np.quantile(rho[..., 0], [0.025, 0.5, 0.975], axis=1)  # (3, T)
+    lower, median, upper = vol
+    rho_lower, rho_median, rho_upper = rho
+
+    columns = {"Date": fitted["date"]}
+    for n, name in enumerate(pair):
+        columns[f"Volatility{name}Median"] = median[:, n]
+        columns[f"Volatility{name}Lower"] = lower[:, n]
+        columns[f"Volatility{name}Upper"] = upper[:, n]
+    columns["RhoMedian"] = rho_median
+    columns["RhoLower"] = rho_lower
+    columns["RhoUpper"] = rho_upper
+    return pl.DataFrame(columns)
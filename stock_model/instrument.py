@@ -0,0 +1,169 @@
+"""
+パイプラインの各段階（取得, 結合, フィルタリング, 最適化, サンプリングなど）の計測
+
+    from stock_model import instrument
+
+    instrument.enable("trace.jsonl", profile="trace.prof")
+    with instrument.span("optimize", model="beta"):
+        ...
+        instrument.count("objective_eval")
+
+spanを抜けるたびに、経過時間, 最大RSS, span内で増えたカウンタをJSON Lines形式で1行書き出す
+環境変数STOCK_MODEL_TRACE（とSTOCK_MODEL_PROFILE, STOCK_MODEL_TRACE_MEMORY）を設定しても
+import時に有効になる
+
+tracemallocによるspanごとのピークメモリはmemory=True（STOCK_MODEL_TRACE_MEMORY=1）のときだけ測る
+小さな配列を大量に作るループ（フィルタリング, 最適化）は数倍遅くなり、経過時間が当てにならなくなるため
+
+無効のとき、spanは何もしない共有のコンテキストマネージャを返し、countは即座に戻るので、
+ループの中から呼んでもほとんどコストはかからない
+"""
+import atexit
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+_enabled = False
+_file = None
+_profiler = None
+_profile_path = None
+_counters = {}
+_stack = []
+_null_span = contextlib.nullcontext()
+
+
+def enable(path, profile=None, memory=False):
+    """
+    計測を有効にする
+
+    Params:
+        path: JSON Linesの出力先（追記する）
+        profile: cProfileの結果（pstats形式）の出力先。Noneならプロファイルしない
+            flameprofやsnakevizでフレームグラフにできる
+        memory: tracemallocでspanごとのピークメモリを測るか（計測対象が遅くなる）
+    """
+    global _enabled, _file, _profiler, _profile_path
+    if _enabled:
+        disable()
+    _file = open(path, "a", buffering=1)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile is not None:
+        _profile_path = profile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    _enabled = True
+
+
+def disable():
+    """
+    計測を止め、カウンタの合計を書き出してファイルを閉じる
+    """
+    global _enabled, _file, _profiler, _profile_path
+    if not _enabled:
+        return
+    _enabled = False
+    _write({"type": "counters", "counters": dict(_counters)})
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_path)
+        _profiler, _profile_path = None, None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _file.close()
+    _file = None
+    _counters.clear()
+    _stack.clear()
+
+
+def count(name, n=1):
+    """
+    カウンタを増やす（フィルタリングのステップ数, 目的関数の評価回数など）
+    """
+    if not _enabled:
+        return
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def span(name, **attrs):
+    """
+    名前付きの区間を計測するコンテキストマネージャを返す
+
+    Params:
+        name: 区間の名前
+        attrs: 一緒に書き出す属性（モデル名, データ件数など）
+    """
+    if not _enabled:
+        return _null_span
+    return _Span(name, attrs)
+
+
+def _write(record):
+    record["pid"] = os.getpid()
+    _file.write(json.dumps(record, default=str) + "\n")
+
+
+class _Span:
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        # 入れ子のspanでtracemallocのピークをリセットするので、
+        # それまでの親のピークを退避しておく
+        if _stack and tracemalloc.is_tracing():
+            parent = _stack[-1]
+            parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+        self.path = "/".join([s.name for s in _stack] + [self.name])
+        self.peak = 0
+        self.counters = dict(_counters)
+        _stack.append(self)
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _stack.pop()
+        record = {
+            "type": "span",
+            "name": self.path,
+            "start": self.wall,
+            "duration": duration,
+            "counters": {k: v - self.counters.get(k, 0) for k, v in _counters.items() if v != self.counters.get(k, 0)},
+        }
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record["peak_memory"] = self.peak
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, self.peak)
+        if resource is not None:
+            record["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(self.attrs)
+        if _file is not None:
+            _write(record)
+        return False
+
+
+atexit.register(disable)
+
+if os.environ.get("STOCK_MODEL_TRACE"):
+    enable(
+        os.environ["STOCK_MODEL_TRACE"],
+        profile=os.environ.get("STOCK_MODEL_PROFILE"),
+        memory=os.environ.get("STOCK_MODEL_TRACE_MEMORY", "") not in ("", "0"),
+    )
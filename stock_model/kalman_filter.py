@@ -0,0 +1,287 @@
+import functools
+import math
+import os
+
+import numpy as np
+
+from . import instrument
+
+
+def filtering(y, m, C, G, F, W, V):
+    """
+    (t-1)期において、1期先（t期）のフィルタリングを行う関数
+    such as:
+        x_t = G_t * x_(t-1) + w_t, w_t ~ N(0, W_t) : 状態方程式
+        y_t = F_t * x_t + v_t, v_t ~ N(0, V_t) : 観測方程式
+    yまたはF_tにnanを含む時点は欠測として扱い、状態を更新せずに一期先予測分布をそのまま返す
+    
+    Params:
+        y: 観測値 [時点t]
+        m, C: 状態の平均, 共分散行列 [t-1]
+        G, F, W, V: 状態遷移行列, 観測行列, 状態誤差の共分散行列, 観測誤差の共分散行列 [t]
+    Returns:
+        tuple
+            フィルタリング分布の平均と共分散行列 m, C [t]
+            一期先予測分布の平均と共分散行列 a, R [t]
+            一期先予測尤度の平均と共分散行列 f, Q [t]
+    """
+    instrument.count("filter_step")
+    # 一期先予測分布
+    a = G @ m
+    R = G @ C @ G.T + W
+    # 一期先予測尤度
+    RFt = R @ F.T
+    f = F @ a
+    Q = F @ RFt + V
+    # yかFがnanなら予測誤差もnanになる
+    e = y - f
+    if np.isnan(e).any():
+        return a, R, a, R, f.item(), Q.item()
+    # カルマンゲイン K = R F' Q^-1 （逆行列は作らない）
+    if Q.shape == (1, 1):
+        K = RFt / Q
+    else:
+        K = np.linalg.solve(Q, RFt.T).T
+    # 状態の更新
+    # 共分散はJoseph形式 (I - KF) R (I - KF)' + K V K' で更新する
+    # R - KFR と違い、状態の次元が大きくても丸め誤差で対称性・半正定値性が崩れない
+    m = a + K @ e
+    IKF = np.eye(len(m)) - K @ F
+    C = IKF @ R @ IKF.T + K @ V @ K.T
+    f_scalar, Q_scalar = f.item(), Q.item()
+    return m, C, a, R, f_scalar, Q_scalar
+
+def smoothing(s, S, m, C, a, R, G):
+    """
+    (t+1)期のsとSからt期のsとSを求める（状態の平滑化分布を求める）
+    
+    Params:
+        s, S: 平滑化分布の平均, 共分散行列 [t+1]
+        m, C: 状態の平均, 共分散行列 [t]
+        a, R: 一期先予測分布の平均と共分散行列 [t+1]
+        G: 状態遷移行列 [t+1]
+    Returns:
+        tuple
+        平滑化分布の平均, 共分散行列 s, S [t]
+    """
+    instrument.count("smooth_step")
+    # 平滑化利得 A = C G' R^-1 （Rは対称なので R A' = G C を解く）
+    A = np.linalg.solve(R, G @ C).T
+    # 平滑化された状態
+    s = m + A @ (s - a)
+    S = C + A @ (S - R) @ A.T
+    return s, S
+
+@functools.lru_cache(maxsize=None)
+def _triu(dims):
+    # 毎時点呼ばれるので、次元ごとに一度だけ作る
+    return np.triu_indices(dims)
+
+def pack_cov(C):
+    """
+    対称行列 (..., dims, dims) を上三角部分だけを並べた (..., dims*(dims+1)/2) に詰める
+    """
+    i, j = _triu(C.shape[-1])
+    return C[..., i, j]
+
+def unpack_cov(P, dims):
+    """
+    pack_covで詰めた共分散行列を (..., dims, dims) に戻す（float64で返す）
+    """
+    i, j = _triu(dims)
+    C = np.empty(P.shape[:-1] + (dims, dims))
+    C[..., i, j] = P
+    C[..., j, i] = P
+    return C
+
+def cov_diag(X, cov):
+    """
+    保存形式（full, packed, diag）によらず、共分散行列の対角成分（分散）を取り出す
+    """
+    if cov == "full":
+        return np.diagonal(X, axis1=-2, axis2=-1)
+    if cov == "packed":
+        # dims*(dims+1)/2 = n から dims を求める
+        dims = int((math.isqrt(8 * X.shape[-1] + 1) - 1) // 2)
+        i, j = _triu(dims)
+        return X[..., i == j]
+    if cov == "diag":
+        return X
+    raise ValueError(f"unknown covariance storage: {cov}")
+
+def _cov_shape(dims, cov):
+    if cov == "full":
+        return (dims, dims)
+    if cov == "packed":
+        return (dims * (dims + 1) // 2,)
+    if cov == "diag":
+        return (dims,)
+    raise ValueError(f"unknown covariance storage: {cov}")
+
+def _store_cov(C, cov):
+    if cov == "full":
+        return C
+    if cov == "packed":
+        return pack_cov(C)
+    return np.diagonal(C)
+
+def _load_cov(X, dims, cov):
+    if cov == "full":
+        return np.asarray(X, dtype=float)
+    if cov == "packed":
+        return unpack_cov(X, dims)
+    raise ValueError("diagonal-only covariances cannot be used for smoothing")
+
+def _allocate(shape, dtype, directory, name):
+    if directory is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+def run_filtering(y, G, F, W, V, m0, C0, cov="full", dtype=np.float64, directory=None):
+    """
+    全時点のフィルタリングを行い、履歴を保存する
+    欠測（nan）の時点は状態を更新せず、対数尤度にも加えない
+
+    Params:
+        y: 観測値 (T,)
+        G, W, V: 状態遷移行列, 状態誤差の共分散行列, 観測誤差の共分散行列
+        F: 各時点の観測行列を並べたもの (T, dims)
+        m0, C0: 状態の初期分布の平均, 共分散行列
+        cov: 共分散行列C, Rの保存形式
+            full: (T, dims, dims)
+            packed: 上三角部分のみ (T, dims*(dims+1)/2)。情報は落ちない
+            diag: 対角成分のみ (T, dims)。標準誤差は求まるが平滑化には使えない
+        dtype: 履歴の型。float32にすると半分になる（計算は常にfloat64で行う）
+        directory: 指定するとそのディレクトリに.npyのメモリマップとして保存する
+    Returns:
+        dict: m, C, a, R, f, Q, loglik, cov
+    """
+    T, dims = len(y), len(m0)
+    cov_shape = _cov_shape(dims, cov)
+    m, a = _allocate((T, dims), dtype, directory, "m"), _allocate((T, dims), dtype, directory, "a")
+    C, R = _allocate((T,) + cov_shape, dtype, directory, "C"), _allocate((T,) + cov_shape, dtype, directory, "R")
+    f, Q = _allocate((T,), dtype, directory, "f"), _allocate((T,), dtype, directory, "Q")
+
+    # 次の時点へはfloat64のまま引き継ぐので、履歴の型は推定値に影響しない
+    _m, _C = m0, C0
+    ll = 0.0
+    for t in range(0, T):
+        _m, _C, _a, _R, _f, _Q = filtering(y[t], _m, _C, G, F[t].reshape((1, dims)), W, V)
+        m[t], a[t], f[t], Q[t] = _m, _a, _f, _Q
+        C[t], R[t] = _store_cov(_C, cov), _store_cov(_R, cov)
+        # 欠測の時点は予測誤差がnanになるので加えない
+        e = y[t] - _f
+        if not math.isnan(e):
+            ll -= (math.log(_Q) + e**2 / _Q) / 2
+    return {"m": m, "C": C, "a": a, "R": R, "f": f, "Q": Q, "loglik": ll, "cov": cov}
+
+def run_smoothing(filtered, G, dtype=np.float64, directory=None):
+    """
+    run_filteringの結果から全時点の平滑化分布を求める
+    欠測の時点もフィルタリング分布が一期先予測分布になっているだけなので、そのまま平滑化できる
+    平滑化分布の共分散行列Sはfilteredと同じ形式で保存する（diagは不可）
+
+    Returns:
+        dict: s, S
+    """
+    m, C, a, R, cov = filtered["m"], filtered["C"], filtered["a"], filtered["R"], filtered["cov"]
+    T, dims = m.shape
+    if cov == "diag":
+        raise ValueError("diagonal-only covariances cannot be used for smoothing")
+    s = _allocate((T, dims), dtype, directory, "s")
+    S = _allocate((T,) + _cov_shape(dims, cov), dtype, directory, "S")
+
+    _s, _S = np.asarray(m[T-1], dtype=float), _load_cov(C[T-1], dims, cov)
+    s[T-1], S[T-1] = _s, _store_cov(_S, cov)
+    for t in range(T - 2, -1, -1):
+        _s, _S = smoothing(
+            _s, _S, np.asarray(m[t], dtype=float), _load_cov(C[t], dims, cov),
+            np.asarray(a[t+1], dtype=float), _load_cov(R[t+1], dims, cov), G
+        )
+        s[t], S[t] = _s, _store_cov(_S, cov)
+    return {"s": s, "S": S}
+
+def loglik(y, G, F, W, V, m0, C0):
+    """
+    履歴を保存せずに対数尤度（定数項を除く）だけを求める（欠測の時点は除く）
+    """
+    dims = len(m0)
+    m, C = m0, C0
+    ll = 0.0
+    for t in range(0, len(y)):
+        m, C, _, _, f, Q = filtering(y[t], m, C, G, F[t].reshape((1, dims)), W, V)
+        e = y[t] - f
+        if not math.isnan(e):
+            ll -= (math.log(Q) + e**2 / Q) / 2
+    return ll
+
+def loglik_batch(y, G, F, W, V, m0, C0):
+    """
+    状態誤差と観測誤差の分散の組ごとの対数尤度（定数項を除く）を、時点のループ一回でまとめて求める
+    観測は1次元に限る。組の数Bが増えてもループの回数は変わらないので、数値微分の評価点をまとめて計算できる
+
+    Params:
+        W: (B, dims, dims)
+        V: (B,)
+    Returns:
+        numpy.ndarray: (B,)
+    """
+    B, dims = len(W), len(m0)
+    m = np.tile(m0, (B, 1))
+    C = np.tile(C0, (B, 1, 1))
+    I = np.eye(dims)
+    ll = np.zeros(B)
+    for t in range(0, len(y)):
+        instrument.count("filter_step", B)
+        Ft = F[t]
+        a = m @ G.T
+        R = G @ C @ G.T + W
+        RFt = R @ Ft
+        f = a @ Ft
+        Q = RFt @ Ft + V
+        # y, Fは組によらないので、欠測かどうかは全組で同じ
+        e = y[t] - f
+        if math.isnan(e[0]):
+            m, C = a, R
+            continue
+        K = RFt / Q[:, np.newaxis]
+        m = a + K * e[:, np.newaxis]
+        # Joseph形式（filteringを参照）
+        IKF = I - K[:, :, np.newaxis] * Ft
+        C = IKF @ R @ IKF.transpose(0, 2, 1) + V[:, np.newaxis, np.newaxis] * K[:, :, np.newaxis] * K[:, np.newaxis, :]
+        ll -= (np.log(Q) + e**2 / Q) / 2
+    return ll
+
+def _variances(w_v, dims):
+    # 分散は負にはならないので、対数を最適化する
+    # w_vが長さ2なら全状態で共通のW、長さdims+1なら状態ごとの対角のW
+    w_v = np.asarray(w_v, dtype=float)
+    W = np.exp(w_v[..., :-1, np.newaxis]) * np.eye(dims)
+    return W, np.exp(w_v[..., -1])
+
+def reverse_loglik_and_grad(w_v, dims, y, G, F, m0, C0):
+    """
+    reverse_loglikの値と、前進差分による勾配を返す（scipy.optimize.minimizeのjac=True用）
+    w_vと、各成分をずらしたlen(w_v)個の点をloglik_batchで一度に評価する
+    """
+    instrument.count("objective_eval")
+    w_v = np.asarray(w_v, dtype=float)
+    # 刻み幅はscipyの2点差分と同じ
+    h = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(w_v))
+    points = np.vstack([w_v, w_v + np.diag(h)])
+    W, V = _variances(points, dims)
+    ll = loglik_batch(y, G, F, W, V, m0, C0)
+    return -ll[0], -(ll[1:] - ll[0]) / h
+
+def reverse_loglik(w_v, dims, y, G, F, m0, C0):
+    """
+    w_vを与えると対数尤度の-1倍を返す関数
+
+    Params:
+        w_v: 状態誤差と観測誤差の分散の対数 [log W, log V]
+            長さ2なら全状態で共通のW、長さdims+1なら状態ごとの対角のW
+    """
+    instrument.count("objective_eval")
+    W, V = _variances(w_v, dims)
+    V = V.reshape((1, 1))
+    return (-1)*loglik(y, G, F, W, V, m0, C0)
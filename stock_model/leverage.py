@@ -0,0 +1,269 @@
+import concurrent.futures
+from itertools import repeat
+
+import numpy as np
+import polars as pl
+
+from .quantile_sketch import QuantileSketch
+from .sources import fetch_jquants_index, read_stooq_csv
+
+
+# 比較する保有期間（営業日）とETFの倍率
+DAYS = (5, 10, 20, 60, 120, 240)
+MULTIPLES = (2, 3, -1, -2, -3)
+
+
+def calc_returns(df):
+    """
+    Date, Close列を持つDataFrameから対前日リターン（単純リターン）を求める
+
+    Params:
+        df: Date, Close列を持つpolars.DataFrame
+    Returns:
+        numpy.ndarray: 日付の昇順に並べた対前日リターン
+    """
+    df = (
+        df
+        .sort("Date")
+        .filter(pl.col("Close").is_not_null())
+        .with_columns(ret=pl.col("Close") / pl.col("Close").shift(1) - 1)
+        .slice(offset=1)
+    )
+    return df.get_column("ret").to_numpy()
+
+
+def load_topix_csv(path):
+    """
+    data/topix.csvからTOPIXの対前日リターンを読み込む
+    """
+    return calc_returns(read_stooq_csv(path))
+
+
+def load_topix_jquants(cli=None):
+    """
+    J-QuantsのTOPIX（code="0000"）から対前日リターンを取得する
+
+    Params:
+        cli: jquantsapi.Client。Noneなら環境変数から作る
+    """
+    return calc_returns(fetch_jquants_index("0000", cli))
+
+
+def _log_growth(returns, multiples):
+    """
+    倍率ごとの日次の対数グロスリターン log(1 + multiple * r) の表を作る
+    1日で-100%以下になる場合は-infとし、以降の資産価値は0のままになる
+
+    Returns:
+        numpy.ndarray: (len(multiples), len(returns))
+    """
+    gross = 1 + np.outer(multiples, returns)
+    with np.errstate(divide="ignore"):
+        return np.log(np.clip(gross, 0, None))
+
+
+def resample_index(rng, n, n_paths, length, method="iid", block_length=20):
+    """
+    ブートストラップの日付インデックスを(n_paths, length)の行列として一度に生成する
+
+    Params:
+        rng: numpy.random.Generator
+        n: リターンの個数
+        n_paths: パスの本数
+        length: 1本のパスの日数
+        method: "iid", "moving_block", "stationary" のいずれか
+            iid: 1日ずつ独立に復元抽出する
+            moving_block: 長さblock_lengthの連続したブロックを一様に選んでつなげる
+            stationary: ブロック長が平均block_lengthの幾何分布に従う（Politis & Romano, 1994）
+                末尾を超えたら先頭に戻る
+        block_length: ブロック長（stationaryでは平均ブロック長）
+    Returns:
+        numpy.ndarray: (n_paths, length)
+    """
+    if method == "iid":
+        return rng.integers(0, n, size=(n_paths, length))
+    steps = np.arange(length)
+    if method == "moving_block":
+        # 各パスのブロックの開始位置を選び、ブロック内の位置を足す
+        n_blocks = -(-length // block_length)
+        starts = rng.integers(0, n - block_length + 1, size=(n_paths, n_blocks))
+        return starts[:, steps // block_length] + steps % block_length
+    if method == "stationary":
+        # 全パスを1本につないだ系列上で、ブロック長（ブロック開始の間隔）を幾何分布から生成する
+        # 幾何分布は無記憶なので、パスの先頭でブロックを強制的に始めても分布は変わらない
+        size = n_paths * length
+        p = 1 / block_length
+        gaps = rng.geometric(p, size=int(size * p) + 1)
+        while gaps.sum() < size:
+            gaps = np.concatenate([gaps, rng.geometric(p, size=int(size * p) + 1)])
+        positions = np.cumsum(gaps)
+        is_start = np.zeros(size, dtype=bool)
+        is_start[positions[positions < size]] = True
+        is_start[::length] = True
+        # 各時点が属するブロックの番号と開始位置から、ブロック内の経過日数を足す
+        # （int32で計算したほうがcumsumと剰余が速い）
+        dtype = np.int32 if size < 2**31 else np.int64
+        block_id = np.cumsum(is_start, dtype=dtype)
+        block_id -= 1
+        block_pos = np.flatnonzero(is_start).astype(dtype)
+        starts = rng.integers(0, n, size=len(block_pos), dtype=dtype)
+        idx = (starts - block_pos)[block_id]
+        idx += np.arange(size, dtype=dtype)
+        idx %= n
+        return idx.reshape(n_paths, length)
+    raise ValueError(f"unknown bootstrap method: {method}")
+
+
+def simulate_chunk(returns, days, multiples, n_paths, seed, method="iid", block_length=20):
+    """
+    n_paths本のブートストラップパスについて、全ての(保有期間, 倍率)の組み合わせの
+    「倍率ETFの最終価値 - 同じ向きの1倍ETFの最終価値」を求める
+
+    リサンプルのインデックスは最長の保有期間ぶんだけ一度だけ生成し、
+    全ての倍率・保有期間で同じ累積対数パスを共有する
+
+    Params:
+        returns: 対前日リターン
+        days: 保有期間のタプル
+        multiples: 倍率のタプル
+        n_paths: パスの本数
+        seed: numpy.random.SeedSequence または整数
+        method, block_length: resample_indexを参照
+    Returns:
+        numpy.ndarray: (n_paths, len(days), len(multiples))
+    """
+    rng = np.random.default_rng(seed)
+    multiples = np.asarray(multiples, dtype=float)
+    # 比較対象は同じ向きの1倍ETF
+    bases = np.sign(multiples)
+    uniq, inv = np.unique(np.concatenate([multiples, bases]), return_inverse=True)
+    table = _log_growth(returns, uniq)
+
+    idx = resample_index(rng, len(returns), n_paths, max(days), method, block_length)
+    # (倍率, パス, 日) の累積対数パス
+    paths = table[:, idx]
+    np.cumsum(paths, axis=2, out=paths)
+    wealth = np.exp(paths[:, :, np.asarray(days) - 1])
+
+    n = len(multiples)
+    diff = wealth[inv[:n]] - wealth[inv[n:]]
+    return diff.transpose(1, 2, 0)
+
+
+def _chunk_sizes(n_replication, chunk_size):
+    n_full, rest = divmod(n_replication, chunk_size)
+    return [chunk_size] * n_full + ([rest] if rest else [])
+
+
+def simulate(returns, days=DAYS, multiples=MULTIPLES, n_replication=1000000, chunk_size=10000, seed=1234, max_workers=None, method="iid", block_length=20):
+    """
+    対前日リターンを復元抽出して、倍率ETFと1倍ETFの最終価値の差をシミュレーションする
+
+    n_replicationを固定サイズのチャンクに分け、チャンクごとにプロセスへ割り振る
+    各チャンクのシードはSeedSequence(seed)から派生させるので、
+    max_workersを変えても結果は変わらない
+
+    Params:
+        returns: 対前日リターン
+        days: 保有期間のタプル
+        multiples: 倍率のタプル
+        n_replication: 試行回数
+        chunk_size: 1チャンクあたりの試行回数（メモリ使用量はこれに比例する）
+        seed: 乱数シード
+        max_workers: プロセス数。1ならプロセスを立てずに逐次実行する
+        method: ブートストラップの方法（"iid", "moving_block", "stationary"）
+            iidでは日次リターンのボラティリティ・クラスタリングが失われ、減価を過小評価しやすい
+        block_length: ブロック長（stationaryでは平均ブロック長）
+    Returns:
+        numpy.ndarray: (n_replication, len(days), len(multiples))
+    """
+    returns = np.ascontiguousarray(returns, dtype=float)
+    sizes = _chunk_sizes(n_replication, chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = (repeat(returns), repeat(days), repeat(multiples), sizes, seeds, repeat(method), repeat(block_length))
+
+    out = np.empty((n_replication, len(days), len(multiples)))
+    if max_workers == 1:
+        results = map(simulate_chunk, *args)
+        _fill(out, sizes, results)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(simulate_chunk, *args)
+            _fill(out, sizes, results)
+    return out
+
+
+def _fill(out, sizes, results):
+    offset = 0
+    for size, diff in zip(sizes, results):
+        out[offset:offset + size] = diff
+        offset += size
+
+
+def sketch_chunk(returns, days, multiples, n_paths, seed, k, method="iid", block_length=20):
+    """
+    simulate_chunkの結果をQuantileSketchにまとめて返す（プロセス間で受け渡すのはスケッチだけ）
+    """
+    rng = np.random.default_rng(seed)
+    diff = simulate_chunk(returns, days, multiples, n_paths, rng, method, block_length)
+    return QuantileSketch(k, shape=(len(days), len(multiples)), seed=rng).update(diff)
+
+
+def simulate_sketch(returns, days=DAYS, multiples=MULTIPLES, n_replication=1000000, chunk_size=10000, seed=1234, max_workers=None, k=200, method="iid", block_length=20):
+    """
+    simulateと同じシミュレーションを行い、全ての試行を保持する代わりに
+    (保有期間, 倍率)ごとの分位点とモーメントをQuantileSketchに集約する
+
+    チャンクごとに作ったスケッチを順にマージするので、メモリ使用量は試行回数に依存しない
+
+    Params:
+        k: QuantileSketchの精度パラメータ（分位点の順位誤差はQuantileSketch.rank_error、k=200で約1.3%）
+        method, block_length: simulateを参照
+    Returns:
+        QuantileSketch: shapeは(len(days), len(multiples))
+    """
+    returns = np.ascontiguousarray(returns, dtype=float)
+    sizes = _chunk_sizes(n_replication, chunk_size)
+    root = np.random.SeedSequence(seed)
+    seeds = root.spawn(len(sizes))
+    args = (repeat(returns), repeat(days), repeat(multiples), sizes, seeds, repeat(k), repeat(method), repeat(block_length))
+
+    sketch = QuantileSketch(k, shape=(len(days), len(multiples)), seed=root.spawn(1)[0])
+    if max_workers == 1:
+        for chunk in map(sketch_chunk, *args):
+            sketch.merge(chunk)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for chunk in executor.map(sketch_chunk, *args):
+                sketch.merge(chunk)
+    return sketch
+
+
+def summarize(diffs, days=DAYS, multiples=MULTIPLES):
+    """
+    simulateの結果を(倍率, 保有期間)ごとに要約する（単位は%）
+
+    Params:
+        diffs: simulateの結果の配列、またはsimulate_sketchの結果のQuantileSketch
+    Returns:
+        polars.DataFrame: multiple, day, median, mean, q05, q95
+    """
+    if isinstance(diffs, QuantileSketch):
+        q05, median, q95 = diffs.quantile([0.05, 0.5, 0.95]) * 100
+        mean = diffs.mean * 100
+    else:
+        diffs = diffs * 100
+        q05, median, q95 = np.percentile(diffs, [5, 50, 95], axis=0)
+        mean = diffs.mean(axis=0)
+    grid_day, grid_multiple = np.meshgrid(days, multiples, indexing="ij")
+    return (
+        pl.DataFrame({
+            "multiple": grid_multiple.ravel(),
+            "day": grid_day.ravel(),
+            "median": median.ravel(),
+            "mean": mean.ravel(),
+            "q05": q05.ravel(),
+            "q95": q95.ravel(),
+        })
+        .sort("multiple", "day")
+    )
@@ -0,0 +1,136 @@
+import logging
+
+import numpy as np
+import polars as pl
+
+from . import instrument, panel
+from .cache import source_of
+from .panel import return_names
+
+
+def prepare_returns(series, start=None, end=None, how="inner"):
+    """
+    系列ごとの対数収益率（%）を日付で揃える
+
+    Params:
+        series: {名前: 系列}（例: {"Topix": "jquants:0000", "Reit": df_reit}）。panel.scanを参照
+        start, end: 推定に使う期間（datetime.date）
+        how: 日付の揃え方。Stanのモデルは欠損を扱えないので"inner"か"asof"
+    Returns:
+        polars.DataFrame: Date, Close{名前}, Ret{名前}, ...
+    """
+    return panel.build(series, how=how, start=start, end=end)
+
+
+def stan_data(df):
+    """
+    prepare_returnsの結果をStanに渡すデータにする（yは(p, n)のC連続な行列）
+    """
+    y = panel.returns_matrix(df)
+    return {"n": y.shape[1], "p": y.shape[0], "y": y}
+
+
+def fit(stan_file, data, chains=4, iter_warmup=1000, iter_sampling=1000, seed=1234, inits=None, show_progress=True,
+        cpp_options=None, stanc_options=None, cache=None):
+    """
+    MSVモデルをサンプリングしてInferenceDataを返す（cmdstanpy, arvizは呼び出し時にimportする）
+    fit.timeは"cmdstanpy"のloggerに出力する
+
+    Params:
+        cpp_options, stanc_options: CmdStanModelに渡すコンパイルの設定
+        cache: stock_model.cache.Cache。Stanのソース, データ, サンプリング・コンパイルの設定,
+            cmdstanpyとCmdStanのバージョンが同じ結果があれば、サンプリングせずにNetCDFから読み込む
+    """
+    import arviz as az
+    import cmdstanpy
+
+    if cache is not None:
+        settings = {
+            "chains": chains, "iter_warmup": iter_warmup, "iter_sampling": iter_sampling,
+            "seed": seed, "inits": inits, "thin": 1,
+        }
+        # CmdStan（stanc, C++のツールチェーン）だけを更新しても別のキーになるようにする
+        toolchain = {
+            "cmdstanpy": cmdstanpy.__version__, "cmdstan": cmdstanpy.cmdstan_version(),
+            "cpp_options": cpp_options, "stanc_options": stanc_options,
+        }
+        key = cache.key("msv.fit", source_of(stan_file), data, settings, toolchain)
+        idata = cache.load(key, ".nc", _read_netcdf)
+        if idata is not None:
+            instrument.count("cache_hit")
+            return idata
+        instrument.count("cache_miss")
+
+    with instrument.span("compile", model=stan_file):
+        model = cmdstanpy.CmdStanModel(stan_file=stan_file, cpp_options=cpp_options, stanc_options=stanc_options)
+    with instrument.span("sample", model=stan_file, n=data["n"]):
+        fit = model.sample(
+            data=data,
+            chains=chains,
+            parallel_chains=chains,
+            iter_warmup=iter_warmup,
+            iter_sampling=iter_sampling,
+            inits=inits,
+            thin=1,
+            seed=seed,
+            refresh=10,
+            show_console=show_progress,
+            show_progress=show_progress,
+        )
+    logging.getLogger("cmdstanpy").info(fit.time)
+    with instrument.span("arviz", model=stan_file):
+        idata = az.from_cmdstanpy(fit)
+    if cache is not None:
+        cache.store(key, ".nc", idata.to_netcdf)
+    return idata
+
+
+def _read_netcdf(path):
+    import arviz as az
+
+    # キャッシュから削除されても困らないよう、遅延読み込みせずにメモリに載せる
+    return az.from_netcdf(path).map(lambda ds: ds.load())
+
+
+def summarize(idata, df):
+    """
+    ボラティリティと相関係数の事後分布の中央値と95%区間を時点ごとに求める
+
+    サンプル数（chain × draw）は数千程度なので、QuantileSketchは使わずに正確な分位点を求める
+
+    Params:
+        idata: fitの結果（posteriorにvolatility, rhoを持つ）
+        df: prepare_returnsの結果
+    Returns:
+        polars.DataFrame: Date, Volatility{名前}Median/Lower/Upper, RhoMedian/Lower/Upper
+    """
+    names = return_names(df)
+    n = df.height
+    q = [0.025, 0.5, 0.975]
+    with instrument.span("summarize", n=n):
+        posterior = idata.posterior
+        vol = posterior["volatility"].quantile(q, dim=("chain", "draw"), skipna=False).values  # (3, p, n)
+        rho = posterior["rho"].quantile(q, dim=("chain", "draw"), skipna=False).values  # (3, n)
+        lower, median, upper = np.concatenate([vol, rho[:, np.newaxis, :]], axis=1)
+
+    columns = {"Date": df.get_column("Date")}
+    for i, name in enumerate(names + ["Rho"]):
+        prefix = name if name == "Rho" else f"Volatility{name}"
+        columns[f"{prefix}Median"] = median[i]
+        columns[f"{prefix}Lower"] = lower[i]
+        columns[f"{prefix}Upper"] = upper[i]
+    return pl.DataFrame(columns)
+
+
+def rolling_corr(df, window_size=250):
+    """
+    比較用の移動相関係数
+    """
+    ret_a, ret_b = [f"Ret{name}" for name in return_names(df)]
+    return (
+        df
+        .with_columns(
+            RhoRolling=pl.rolling_corr(pl.col(ret_a), pl.col(ret_b), window_size=window_size)
+        )
+        .select(["Date", "RhoRolling"])
+    )
@@ -0,0 +1,130 @@
+"""
+複数系列の終値から、日付を揃えた対数収益率（%）のパネルを作る
+
+系列の読み込み（CSVなら）から収益率の計算, 日付の結合, 期間の絞り込みまでを一つのLazyFrameで組み立て、
+collectは最後に一度だけ行う
+
+    df = panel.build({"Topix": "jquants:0000", "USDJPY": "boj:usdjpy_boj_17.csv"}, how="asof")
+    y = panel.returns_matrix(df)  # (p, n), C連続
+"""
+import datetime
+
+import polars as pl
+
+from . import instrument, sources
+
+HOWS = ("inner", "outer", "asof")
+# stooq, jquantsから取得するときにstartより遡る日数（startの日の収益率に要る前の取引日の終値を含める）
+_LOOKBACK = datetime.timedelta(days=14)
+
+
+def _lazy(series, start=None, end=None):
+    """
+    "ソース:識別子"の文字列, DataFrame, LazyFrameのいずれかをDate, CloseのLazyFrameにする
+    start, endは文字列の系列を取得する期間（stooq, jquantsのみ。sources.scanを参照）
+    """
+    if isinstance(series, str):
+        return sources.scan(series, start=start, end=end)
+    if isinstance(series, pl.DataFrame):
+        return series.lazy()
+    return series
+
+
+def _log_return(name):
+    close = pl.col(f"Close{name}")
+    return ((close.log() - close.log().shift(1))*100).alias(f"Ret{name}")
+
+
+def scan(series, how="inner", start=None, end=None, tolerance=None):
+    """
+    パネルを作るLazyFrameを組み立てる
+
+    Params:
+        series: {名前: 系列}。系列は"ソース:識別子"（sources.scanを参照）, またはDate, Close列のDataFrame/LazyFrame
+        how: 日付の揃え方
+            inner: すべての系列に終値がある日だけ残す。収益率は系列ごとに前の取引日からのもの
+            outer: いずれかの系列に終値がある日を残す。終値がない系列の収益率はnull
+            asof: 最初の系列の日付に揃え、他の系列はその日以前で最新の終値を使う。収益率は揃えた後の終値から求める
+        start, end: 残す期間（datetime.dateまたは"YYYY-MM-DD"）。収益率を求めた後で絞り込むので、startの日の収益率も残る
+            stooq, jquantsの系列はこの期間（startの少し前から）を取得する。stooqはstartが必須
+        tolerance: asofで遡る上限（例: "5d", datetime.timedelta(days=5)）
+    Returns:
+        polars.LazyFrame: Date, Close{名前}, Ret{名前}, ...（日付の昇順）
+    """
+    if how not in HOWS:
+        raise ValueError(f"how must be one of {HOWS}: {how}")
+    if not series:
+        raise ValueError("series must not be empty")
+
+    start = None if start is None else sources.to_date(start)
+    end = None if end is None else sources.to_date(end)
+    fetch_start = None if start is None else start - _LOOKBACK
+    frames = []
+    for name, s in series.items():
+        lf = (
+            _lazy(s, start=fetch_start, end=end)
+            .select("Date", pl.col("Close").cast(pl.Float64).alias(f"Close{name}"))
+            .filter(pl.col(f"Close{name}").is_not_null())
+            .sort("Date")
+        )
+        if how != "asof":
+            lf = lf.with_columns(_log_return(name))
+        frames.append(lf)
+
+    df = frames[0]
+    for lf in frames[1:]:
+        if how == "inner":
+            df = df.join(lf, on="Date", how="inner")
+        elif how == "outer":
+            df = df.join(lf, on="Date", how="full", coalesce=True)
+        else:
+            df = df.join_asof(lf, on="Date", strategy="backward", tolerance=tolerance)
+    if how == "asof":
+        df = df.with_columns([_log_return(name) for name in series])
+
+    rets = [f"Ret{name}" for name in series]
+    if how == "outer":
+        # 全系列の収益率がnullの日（各系列の初日など）だけ落とす
+        df = df.sort("Date").filter(pl.any_horizontal(pl.col(rets).is_not_null()))
+    else:
+        df = df.sort("Date").drop_nulls()
+    if start is not None:
+        df = df.filter(pl.col("Date") >= start)
+    if end is not None:
+        df = df.filter(pl.col("Date") <= end)
+    columns = [c for name in series for c in (f"Close{name}", f"Ret{name}")]
+    return df.select("Date", *columns)
+
+
+def build(series, how="inner", start=None, end=None, tolerance=None):
+    """
+    scanで組み立てたパネルを実行する（引数はscanを参照）
+
+    Returns:
+        polars.DataFrame: Date, Close{名前}, Ret{名前}, ...
+    """
+    lf = scan(series, how=how, start=start, end=end, tolerance=tolerance)
+    with instrument.span("join", how=how, p=len(series)):
+        return lf.collect()
+
+
+def return_names(df):
+    """
+    パネルから系列の名前（Ret{名前}の{名前}）を取り出す
+    """
+    return [col.removeprefix("Ret") for col in df.columns if col.startswith("Ret")]
+
+
+def returns_matrix(df, names=None):
+    """
+    収益率を(p, n)のC連続な配列にする（StanのyやカルマンフィルタのFの列にそのまま渡せる）
+
+    polarsは列ごとに連続したFortran順の(n, p)配列を作るので、その転置を返せばコピーは一度で済む
+    nullはnanになる
+
+    Params:
+        names: 取り出す系列の名前（Noneならすべて）
+    """
+    if names is None:
+        names = return_names(df)
+    return df.select([pl.col(f"Ret{name}").cast(pl.Float64) for name in names]).to_numpy(order="fortran").T
@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    マージ可能なストリーミング分位点スケッチ（KLL）とモーメント（件数, 平均, 分散, 最小, 最大）
+
+    shapeの各要素を独立したストリームとして同時に扱う
+    （例: (保有期間, 倍率)の組み合わせごと）
+    全ての要素に毎回同じ件数の値が入るので、コンパクションは要素方向にベクトル化できる
+
+    保持する値の数は約3k + O(log n)で、試行回数nにほぼ依存しない
+    nがkの数倍程度（MCMCのサンプルなど）なら、全件から正確な分位点を求めるほうが速くて省メモリ
+    分位点の順位誤差は確率99%でrank_error（k=200で約1.3%）以内
+
+    Params:
+        k: 最上位レベルの容量（大きいほど高精度）
+        shape: ストリームの形
+        seed: コンパクションに使う乱数シード（numpy.random.default_rngに渡せるもの）
+    """
+
+    _c = 2 / 3
+
+    def __init__(self, k=200, shape=(), seed=None):
+        self.k = k
+        self.shape = tuple(shape)
+        self.levels = []
+        self.count = 0
+        self.mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def rank_error(self):
+        """1つの分位点に対する正規化順位誤差（確率99%）"""
+        return 2.296 / self.k**0.9723
+
+    @property
+    def var(self):
+        """不偏分散（値が1個以下ならnan）"""
+        if self.count < 2:
+            return np.full(self.shape, np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def n_retained(self):
+        """スケッチが保持している1ストリームあたりの値の数"""
+        return sum(len(level) for level in self.levels)
+
+    def _capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(2, math.ceil(self.k * self._c**depth))
+
+    def _update_moments(self, count, mean, m2, vmin, vmax):
+        # Chanらの並列アルゴリズムで平均と偏差平方和を合成する
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self._m2 = self._m2 + m2 + delta**2 * self.count * count / total
+        self.count = total
+        self.min = np.minimum(self.min, vmin)
+        self.max = np.maximum(self.max, vmax)
+
+    def update(self, values):
+        """
+        値をまとめて追加する
+
+        Params:
+            values: (m, *shape) の配列
+        """
+        values = np.asarray(values, dtype=float).reshape((-1,) + self.shape)
+        if len(values) == 0:
+            return self
+        mean = values.mean(axis=0)
+        self._update_moments(
+            len(values), mean, ((values - mean)**2).sum(axis=0), values.min(axis=0), values.max(axis=0)
+        )
+        self._push(0, values)
+        self._compress()
+        return self
+
+    def _push(self, h, values):
+        if h == len(self.levels):
+            self.levels.append(values)
+        else:
+            self.levels[h] = np.concatenate([self.levels[h], values])
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) >= self._capacity(h):
+                level = np.sort(level, axis=0)
+                # 奇数個のときは1つをそのレベルに残し、残りの半分を1つ上のレベルへ昇格させる
+                n_even = len(level) - len(level) % 2
+                offset = self._rng.integers(2)
+                self.levels[h] = level[n_even:]
+                self._push(h + 1, level[offset:n_even:2])
+            h += 1
+
+    def merge(self, other):
+        """
+        同じk, shapeのスケッチをマージする（自身を更新して返す）
+        """
+        if other.k != self.k or other.shape != self.shape:
+            raise ValueError("cannot merge sketches with different k or shape")
+        if other.count == 0:
+            return self
+        self._update_moments(other.count, other.mean, other._m2, other.min, other.max)
+        for h, level in enumerate(other.levels):
+            self._push(h, level)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+        分位点を求める
+
+        Params:
+            q: 分位点（スカラーまたは配列）
+        Returns:
+            numpy.ndarray: qがスカラーならshape、配列なら(len(q), *shape)（値が1個もなければnan）
+        """
+        if self.count == 0:
+            return np.full(np.shape(q) + self.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, axis=0)
+        items = np.take_along_axis(items, order, axis=0)
+        cum_weights = np.cumsum(weights[order], axis=0)
+        total = cum_weights[-1]
+
+        qs = np.atleast_1d(q)
+        res = np.empty((len(qs),) + self.shape)
+        for i, _q in enumerate(qs):
+            idx = np.minimum((cum_weights < _q * total).sum(axis=0), len(items) - 1)
+            res[i] = np.take_along_axis(items, idx[np.newaxis], axis=0)[0]
+        return res[0] if np.ndim(q) == 0 else res
@@ -0,0 +1,65 @@
+import datetime
+import math
+
+import polars as pl
+
+
+mu_1 = 2**(1/2) * math.gamma(1) * math.gamma(1/2)**(-1)
+mu_4over3 = 2**(2/3) * math.gamma(7/6) * math.gamma(1/2)**(-1)
+
+
+def read_klines(path):
+    """
+    01_fetch.pyで保存した5分足のCSVを読み込み、営業日の列dateを付ける
+
+    元のtimestamp列はUTCっぽい
+    JSTの6:00がその日の始まり（月曜日は7:00）
+    """
+    return (
+        pl.read_csv(path)
+        .rename({"openTime": "openTimeUtc"})
+        .with_columns(
+            timestamp_utc=pl.from_epoch(pl.col("openTimeUtc").cast(int), time_unit="ms")
+        )
+        .with_columns(
+            timestamp_jst=pl.col("timestamp_utc")+datetime.timedelta(hours=9),
+            timestamp=pl.col("timestamp_utc")+datetime.timedelta(hours=9)-datetime.timedelta(hours=6)
+        )
+        .with_columns(date=pl.col("timestamp").dt.date())
+    )
+
+
+def realized_measures(df, alpha=0.95):
+    """
+    日ごとの実現ボラティリティ(rv), bipower variation(bv), tripower quarticity(tq)を求め、
+    ジャンプの検定統計量zが有意ならrvをジャンプ(j)と連続部分(c)に分ける
+
+    Params:
+        df: read_klinesの結果
+        alpha: ジャンプ検定の有意水準（片側）
+    Returns:
+        polars.DataFrame: date, n, rv, bv, tq, z, j, c
+    """
+    from scipy.stats import norm
+
+    return (
+        df
+        .with_columns(ret=(pl.col("close").log() - pl.col("close").shift(1).log()) * 100)
+        .group_by("date")
+        .agg(
+            n=pl.len(),
+            rv=(pl.col("ret")**2).sum(),
+            bv=mu_1**(-2) * (pl.col("ret").abs() * pl.col("ret").shift(1).abs()).sum(),
+            tq=pl.len() * mu_4over3**(-3) * (pl.col("ret").abs()**(4/3) * pl.col("ret").shift(1).abs()**(4/3) * pl.col("ret").shift(2).abs()**(4/3)).sum(),
+        )
+        .sort("date")
+        .with_columns(
+            z=(pl.col("rv").log() - pl.col("bv").log()) / ((mu_1**(-4) + 2 * mu_1**(-2) - 5) * pl.col("tq") * pl.col("bv")**(-2) / pl.col("n"))**(1/2)
+        )
+        .with_columns(
+            j=pl.when(pl.col("z") > norm.ppf(alpha)).then(pl.col("rv") - pl.col("bv")).otherwise(pl.lit(0))
+        )
+        .with_columns(
+            c=pl.col("rv") - pl.col("j")
+        )
+    )
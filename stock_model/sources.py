@@ -0,0 +1,155 @@
+import datetime
+import os
+
+import polars as pl
+
+
+def scan_stooq_csv(path):
+    """
+    data/*.csv（stooq形式のCSV）を遅延読み込みする
+    1行目は銘柄名（Shift_JIS）、日付は降順、数値は先頭に空白が入っている
+
+    Returns:
+        polars.LazyFrame: Date, Close（日付の昇順）
+    """
+    return (
+        pl.scan_csv(path, skip_rows=1, encoding="utf8-lossy")
+        .select(
+            Date=pl.col("Date").str.strptime(pl.Date, format="%Y-%m-%d"),
+            Close=pl.col("Close").str.strip_chars().cast(pl.Float64),
+        )
+        .filter(pl.col("Close").is_not_null())
+        .sort("Date")
+    )
+
+
+def read_stooq_csv(path):
+    """
+    data/*.csv（stooq形式のCSV）を読み込む
+
+    Returns:
+        polars.DataFrame: Date, Close（日付の昇順）
+    """
+    return scan_stooq_csv(path).collect()
+
+
+def fetch_stooq(symbol, start=None, end=None):
+    """
+    stooqから日次の終値を取得する（pandas_datareaderは呼び出し時にimportする）
+    データソース的に数レコードだけ終値がnullの日付があるので削除する
+    startを省略するとpandas_datareaderは直近5年分しか取得しないので、長い期間が要るときは必ず指定する
+    """
+    import pandas_datareader.data as pdr
+
+    raw = pdr.DataReader(symbol, data_source="stooq", start=start, end=end)
+    return (
+        pl.from_pandas(raw.reset_index())
+        .select(Date=pl.col("Date").dt.date(), Close=pl.col("Close"))
+        .filter(pl.col("Close").is_not_null())
+        .sort("Date")
+    )
+
+
+def fetch_jquants_index(code, cli=None, start=None, end=None):
+    """
+    J-Quantsから指数の日次の終値を取得する（jquantsapiは呼び出し時にimportする）
+
+    Params:
+        code: 指数コード（TOPIXは"0000", 東証REIT指数は"0075"）
+        cli: jquantsapi.Client。Noneなら環境変数JQUANTS_EMAIL, JQUANTS_PASSWORDから作る
+        start, end: 取得する期間（datetime.dateまたは"YYYY-MM-DD"。Noneなら取得できるすべて）
+    """
+    if cli is None:
+        import jquantsapi
+
+        cli = jquantsapi.Client(mail_address=os.environ["JQUANTS_EMAIL"], password=os.environ["JQUANTS_PASSWORD"])
+    from_yyyymmdd = "" if start is None else to_date(start).strftime("%Y%m%d")
+    to_yyyymmdd = "" if end is None else to_date(end).strftime("%Y%m%d")
+    return (
+        pl.from_pandas(cli.get_indices(code=code, from_yyyymmdd=from_yyyymmdd, to_yyyymmdd=to_yyyymmdd))
+        .select(Date=pl.col("Date").cast(pl.Date), Close=pl.col("Close"))
+        .filter(pl.col("Close").is_not_null())
+        .sort("Date")
+    )
+
+
+def scan_boj_csv(path):
+    """
+    日本銀行の時系列統計データ（USDJPYなど）のCSVを遅延読み込みする
+    欠損は"NA"という文字列で入っている
+    """
+    return (
+        pl.scan_csv(path, infer_schema=False)
+        .select(
+            Date=pl.col("date").str.strptime(pl.Date, format="%Y/%m/%d"),
+            Close=pl.col("price"),
+        )
+        .filter((pl.col("Close").is_not_null()) & (pl.col("Close") != "NA"))
+        .with_columns(Close=pl.col("Close").cast(pl.Float64))
+        .sort("Date")
+    )
+
+
+def read_boj_csv(path):
+    """
+    日本銀行の時系列統計データ（USDJPYなど）のCSVを読み込む
+    """
+    return scan_boj_csv(path).collect()
+
+
+def scan(spec, start=None, end=None):
+    """
+    "ソース:識別子"の形式で指定した系列をLazyFrameにする
+
+        stooq:9501.JP, jquants:0000, boj:usdjpy_boj_17.csv, csv:data/topix.csv
+
+    CSV（boj, csv）はファイルの読み込みから遅延させるので、後続の処理と一つのクエリとして最適化される
+    stooq, jquantsは取得した結果をLazyFrameにする
+
+    Params:
+        spec: 系列の指定
+        start, end: stooq, jquantsで取得する期間（datetime.dateまたは"YYYY-MM-DD"）
+            CSVはファイルのすべてを返すので、期間の絞り込みは呼び出し側で行う
+    Returns:
+        polars.LazyFrame: Date, Close（日付の昇順）
+    """
+    source, _, key = spec.partition(":")
+    if source == "stooq":
+        if start is None:
+            # pandas_datareaderは直近5年分だけを返し、それより前の履歴が黙って欠ける
+            raise ValueError(f"stooq needs an explicit start date (only the last 5 years are fetched otherwise): {spec}")
+        return fetch_stooq(key, start, end).lazy()
+    elif source == "jquants":
+        return fetch_jquants_index(key, start=start, end=end).lazy()
+    elif source == "boj":
+        return scan_boj_csv(key)
+    elif source == "csv":
+        return scan_stooq_csv(key)
+    raise ValueError(f"unknown source: {spec}")
+
+
+def load(spec, start=None, end=None):
+    """
+    "ソース:識別子"の形式で指定した系列を読み込む（指定の形式はscanを参照）
+
+    Params:
+        spec: 系列の指定
+        start, end: 取得する期間（datetime.dateまたは"YYYY-MM-DD"）
+    Returns:
+        polars.DataFrame: Date, Close（日付の昇順）
+    """
+    df = scan(spec, start, end)
+    if start is not None:
+        df = df.filter(pl.col("Date") >= to_date(start))
+    if end is not None:
+        df = df.filter(pl.col("Date") <= to_date(end))
+    return df.collect()
+
+
+def to_date(value):
+    """
+    "YYYY-MM-DD"の文字列をdatetime.dateにする（それ以外はそのまま返す）
+    """
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value